@@ -1,13 +1,35 @@
 import csv
 from pathlib import Path
-import shutil
 import sqlite3
 import tempfile
-from dtbase.model.estimate import Estimate, EstimateTypes
+import weakref
+from dtbase.model.estimate import Estimate
 from dtbase.model.link import Link
 from dtbase.model.node import Node
 from dtbase.model.reference import Reference
 
+# open connections keyed by resolved database path, shared between DB instances
+_connections = weakref.WeakValueDictionary()
+
+class _Connection(sqlite3.Connection):
+    '''
+    sqlite3 Connection that can be weakly referenced and shared between DB instances.
+
+    Attributes
+    ----------
+    users (int) : the number of DB instances currently using the connection.
+    ids (dict) : cached id sets of the nodes, links and sources tables, keyed by table name.
+        Kept on the connection so every DB instance sharing it sees the same ids.
+    '''
+    users = 0
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Opens the connection with an empty id cache.
+        '''
+        super().__init__(*args, **kwargs)
+        self.ids = {}
+
 class DB:
     '''
     Handles database operations for the model.
@@ -17,66 +39,136 @@ class DB:
     file_path (str) : the file path to write the database to.
     con (sqlite3.Connection) : sqlite3 Connection object to connect to the database.
     cursor (sqlite3.Cursor) : sqlite3 Curor object to manipulate the database.
+    _ids (dict) : the id cache of the connection, see _Connection.ids.
     '''
-    def __init__(self, file_path: str):
+    # SQL shared by the hot accessors so sqlite3 reuses the compiled statements.
+    _SQL_ADD_NODE = 'insert into nodes values (?, ?, ?)'
+    _SQL_GET_NODE = 'select * from nodes where node_id = ?'
+    _SQL_ADD_LINK = 'insert into links values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    _SQL_GET_LINK = 'select * from links where link_id = ?'
+    _SQL_ADD_REFERENCE = 'insert into sources values(?, ?, ?, ?, ?, ?)'
+    _SQL_GET_REFERENCE = 'select * from sources where ref_id = ?'
+    # size of the per-connection prepared statement cache
+    cached_statements = 256
+    # schema script shared by create_tables and clear
+    _SQL_CREATE_TABLES = '''
+        create table if not exists nodes(
+            node_id text primary key,
+            name text,
+            keywords text);
+        create table if not exists sources(
+            ref_id text primary key,
+            title text not null,
+            authors text,
+            year text,
+            publication_type text,
+            publisher text);
+        create table if not exists links(
+            link_id text primary key,
+            parent_id text not null,
+            child_id text not null,
+            m1_type text not null,
+            m1_a real not null,
+            m1_b real not null,
+            m2_type text not null,
+            m2_a real not null,
+            m2_b real not null,
+            m3_type text not null,
+            m3_a real not null,
+            m3_b real not null,
+            m1_memo text,
+            m2_memo text,
+            m3_memo text,
+            ref_id text,
+            edge_key integer not null,
+            foreign key(parent_id) references nodes(node_id),
+            foreign key(child_id) references nodes(node_id),
+            foreign key(ref_id) references sources(ref_id),
+            unique(link_id),
+            unique(parent_id, child_id, edge_key));
+        create table if not exists positions(
+            node_id text primary key,
+            x real not null,
+            y real not null);
+        create index if not exists idx_links_parent on links(parent_id);
+        create index if not exists idx_links_child on links(child_id);
+        create index if not exists idx_links_ref on links(ref_id);
+    '''
+
+    def __init__(self, file_path: str, uri: bool=True):
         '''
         Constructs a db instance and connects to the database in memory.
 
         Parameters
         ----------
         file_path (str) : the file path to write the db file to.
+        uri (bool) : if True, open the file in shared-cache mode and reuse the connection
+            of any other DB instance open on the same file.
         '''
         self.file_path = Path(file_path)
-        self.con = sqlite3.connect(self.file_path)
+        self.con = DB.connect(file_path, uri)
+        self.con.users += 1
+        self.con.row_factory = sqlite3.Row
         self.cursor = self.con.cursor()
+        self._ids = self.con.ids
+        if file_path != ':memory:':
+            self.cursor.execute('pragma journal_mode=WAL')
+        self.cursor.execute('pragma synchronous=NORMAL')
+        self.cursor.execute('pragma temp_store=MEMORY')
+        self.cursor.execute('pragma cache_size=-65536')
+        self.cursor.execute('pragma mmap_size=268435456')
         self.create_tables()
 
+    @staticmethod
+    def connect(file_path: str, uri: bool=True) -> sqlite3.Connection:
+        '''
+        Returns a connection to the database at file_path, reusing an open shared
+        connection to the same file when uri is True.
+
+        Parameters
+        ----------
+        file_path (str) : the file path of the database.
+        uri (bool) : if True, connect through a shared-cache URI and pool the connection.
+        '''
+        if not uri or file_path == ':memory:':
+            return sqlite3.connect(file_path, cached_statements=DB.cached_statements,
+                factory=_Connection)
+        path = Path(file_path).resolve()
+        con = _connections.get(str(path))
+        if con is None:
+            con = sqlite3.connect(f'{path.as_uri()}?cache=shared', uri=True,
+                check_same_thread=False, cached_statements=DB.cached_statements,
+                factory=_Connection)
+            _connections[str(path)] = con
+        return con
+
+    @staticmethod
+    def reset_pool() -> None:
+        '''
+        Forgets every pooled connection, so the next connect opens new ones. A forked process
+        must call this before connecting, as it cannot share the connections of its parent.
+        '''
+        _connections.clear()
+
     def create_tables(self) -> None:
         '''
         Creates the nodes, sources, and links database tables if they have not
         yet been created.
         '''
-        self.cursor.execute('''create table if not exists nodes(
-                                    node_id text primary key,
-                                    name text, 
-                                    keywords text)''')
-        self.cursor.execute('''create table if not exists sources(
-                                    ref_id text primary key, 
-                                    title text not null, 
-                                    authors text, 
-                                    year text,
-                                    publication_type text, 
-                                    publisher text)''')
-        self.cursor.execute('''create table if not exists links(
-                                    link_id text primary key,
-                                    parent_id text not null, 
-                                    child_id text not null,
-                                    m1_type text not null,
-                                    m1_a real not null,
-                                    m1_b real not null,
-                                    m2_type text not null,
-                                    m2_a real not null,
-                                    m2_b real not null,
-                                    m3_type text not null,
-                                    m3_a real not null,
-                                    m3_b real not null,
-                                    m1_memo text,
-                                    m2_memo text, 
-                                    m3_memo text, 
-                                    ref_id text,
-                                    edge_key integer not null,
-                                    foreign key(parent_id) references nodes(node_id),
-                                    foreign key(child_id) references nodes(node_id),
-                                    foreign key(ref_id) references sources(ref_id),
-                                    unique(link_id),
-                                    unique(parent_id, child_id, edge_key))''')
-        self.con.commit()
+        self.cursor.executescript(DB._SQL_CREATE_TABLES)
             
     def __del__(self):
         '''
-        Closes the database connection on deletion of the object.
+        Closes the database connection on deletion of the object, unless another DB
+        instance is still sharing it.
         '''
-        self.con.close()
+        try:
+            self.con.users -= 1
+            if not self.con.users:
+                self.con.close()
+        except Exception:
+            pass
+        self.con = None
 
     def add_node(self, node: Node) -> None:
         '''
@@ -86,9 +178,20 @@ class DB:
         ----------
         node (Node) : a Node object to be added to the database.
         '''
-        self.cursor.execute('insert into nodes values (?, ?, ?)', 
-            node.to_tuple())
-        self.con.commit()
+        self.add_nodes([node])
+
+    def add_nodes(self, nodes: list) -> None:
+        '''
+        Adds a list of nodes to the database in a single transaction.
+
+        Parameters
+        ----------
+        nodes (list) : a list of Node objects to be added to the database.
+        '''
+        nodes = list(nodes)
+        with self.con:
+            self.cursor.executemany(DB._SQL_ADD_NODE, [node.to_tuple() for node in nodes])
+        self._cache_add('nodes', (node.node_id for node in nodes))
 
     def remove_node(self, node_id: str) -> None:
         '''
@@ -98,10 +201,14 @@ class DB:
         ----------
         node_id (str) : the id of the Node to remove.
         '''
-        self.cursor.execute('delete from nodes where node_id = ?', (node_id,))
-        self.cursor.execute('delete from links where child_id = ? or parent_id = ?', 
-            (node_id, node_id))
-        self.con.commit()
+        # the deletes run as one transaction, each using the index on its column
+        with self.con:
+            self.cursor.execute('delete from nodes where node_id = ?', (node_id,))
+            self.cursor.execute('delete from positions where node_id = ?', (node_id,))
+            self.cursor.execute('delete from links where child_id = ?', (node_id,))
+            self.cursor.execute('delete from links where parent_id = ?', (node_id,))
+        self._cache_discard('nodes', node_id)
+        self._ids.pop('links', None)
 
     def get_node(self, node_id: str) -> Node:
         '''
@@ -111,11 +218,10 @@ class DB:
         ----------
         node_id (str) : the id of the Node to retrieve.
         '''
-        node_tup = self.cursor.execute('select * from nodes where node_id = ?', 
-            (node_id,)).fetchone()
-        if not node_tup:
+        row = self.cursor.execute(DB._SQL_GET_NODE, (node_id,)).fetchone()
+        if not row:
             return None
-        return Node(*node_tup)
+        return Node(row['node_id'], row['name'], row['keywords'])
 
     def add_link(self, link: Link) -> None:
         '''
@@ -125,10 +231,20 @@ class DB:
         ----------
         link (Link) : the Link object to add to the database.
         '''
-        self.cursor.execute('')
-        self.cursor.execute('insert into links values (?, ?, ?, ?,\
-            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', link.to_tuple())
-        self.con.commit()
+        self.add_links([link])
+
+    def add_links(self, links: list) -> None:
+        '''
+        Adds a list of Links to the database in a single transaction.
+
+        Parameters
+        ----------
+        links (list) : a list of Link objects to add to the database.
+        '''
+        links = list(links)
+        with self.con:
+            self.cursor.executemany(DB._SQL_ADD_LINK, [link.to_tuple() for link in links])
+        self._cache_add('links', (link.link_id for link in links))
 
     def remove_link(self, link_id: str) -> None:
         '''
@@ -140,6 +256,7 @@ class DB:
         '''
         self.cursor.execute('delete from links where link_id = ?', (link_id,))
         self.con.commit()
+        self._cache_discard('links', link_id)
 
     def get_link(self, link_id: str) -> Link:
         '''
@@ -149,14 +266,45 @@ class DB:
         ----------
         link_id (str) : the id of the Link to retrieve.
         '''
-        link_tup = self.cursor.execute('select * from links where link_id = ?', 
-            (link_id,)).fetchone()
-        if not link_tup:
+        row = self.cursor.execute(DB._SQL_GET_LINK, (link_id,)).fetchone()
+        if not row:
             return None
-        m1 = Estimate(EstimateTypes(link_tup[3]), link_tup[4], link_tup[5])
-        m2 = Estimate(EstimateTypes(link_tup[6]), link_tup[7], link_tup[8])
-        m3 = Estimate(EstimateTypes(link_tup[9]), link_tup[10], link_tup[11])
-        return Link(*link_tup[0:3], m1, m2, m3, *link_tup[12:])
+        return DB._link_from_row(row)
+
+    def iter_links(self, child_id: str=None):
+        '''
+        Yields every Link in the database from a single query.
+
+        Parameters
+        ----------
+        child_id (str) : if given, only the Links pointing to the Node with this id are yielded.
+        '''
+        if child_id is None:
+            rows = self.con.execute('select * from links')
+        else:
+            rows = self.con.execute('select * from links where child_id = ?', (child_id,))
+        for row in rows:
+            yield DB._link_from_row(row)
+
+    def link_endpoints(self) -> list:
+        '''
+        Returns a list of (link_id, parent_id, child_id, edge_key) tuples for every Link,
+        without constructing the Links or their Estimates.
+        '''
+        return self.con.execute('select link_id, parent_id, child_id, edge_key from links').fetchall()
+
+    @staticmethod
+    def _link_from_row(row: sqlite3.Row) -> Link:
+        '''
+        Returns the Link object represented by a row of the links table.
+
+        Parameters
+        ----------
+        row (sqlite3.Row) : a row of the links table.
+        '''
+        return Link(row['link_id'], row['parent_id'], row['child_id'],
+            Estimate.from_row(row, 'm1'), Estimate.from_row(row, 'm2'), Estimate.from_row(row, 'm3'),
+            row['m1_memo'], row['m2_memo'], row['m3_memo'], row['ref_id'], row['edge_key'])
 
     def add_reference(self, reference: Reference) -> None:
         '''
@@ -166,9 +314,20 @@ class DB:
         ----------
         reference (Reference) : the Reference to add to the database.
         '''
-        self.cursor.execute('insert into sources values(?, ?, ?, ?, ?, ?)', 
-            reference.to_tuple())
-        self.con.commit()
+        self.add_references([reference])
+
+    def add_references(self, references: list) -> None:
+        '''
+        Adds a list of References to the database in a single transaction.
+
+        Parameters
+        ----------
+        references (list) : a list of Reference objects to add to the database.
+        '''
+        references = list(references)
+        with self.con:
+            self.cursor.executemany(DB._SQL_ADD_REFERENCE, [reference.to_tuple() for reference in references])
+        self._cache_add('sources', (reference.ref_id for reference in references))
 
     def remove_reference(self, ref_id: str) -> None:
         '''
@@ -178,9 +337,21 @@ class DB:
         ----------
         ref_id (str) : the ref_id of the Reference to remove from the database.
         '''
-        self.cursor.execute('delete from sources where ref_id = ?', (ref_id,))
-        self.cursor.execute('delete from links where ref_id = ?', (ref_id,))
-        self.con.commit()
+        with self.con:
+            self.cursor.execute('delete from sources where ref_id = ?', (ref_id,))
+            self.cursor.execute('delete from links where ref_id = ?', (ref_id,))
+        self._cache_discard('sources', ref_id)
+        self._ids.pop('links', None)
+
+    def reference_links(self, ref_id: str) -> set:
+        '''
+        Returns the set of link_ids of all the Links supported by the Reference with the given ref_id.
+
+        Parameters
+        ----------
+        ref_id (str) : the ref_id of the Reference.
+        '''
+        return { tup[0] for tup in self.cursor.execute('select link_id from links where ref_id = ?', (ref_id,)) }
 
     def get_reference(self, ref_id: str) -> Reference:
         '''
@@ -190,56 +361,121 @@ class DB:
         ----------
         reference (Reference) : the ref_id of the Reference to retrieve from the database.
         '''
-        ref_tup = self.cursor.execute('select * from sources where ref_id = ?', 
-            (ref_id,)).fetchone()
+        ref_tup = self.cursor.execute(DB._SQL_GET_REFERENCE, (ref_id,)).fetchone()
         if not ref_tup:
             return None
         return Reference(*ref_tup)
 
+    def _cached_ids(self, table: str, column: str) -> set:
+        '''
+        Returns the cached set of ids of a table, reading it from the database on first use.
+
+        Parameters
+        ----------
+        table (str) : the name of the table.
+        column (str) : the name of the id column of the table.
+        '''
+        ids = self._ids.get(table)
+        if ids is None:
+            ids = self._ids[table] = { tup[0] for tup in self.cursor.execute(f'select {column} from {table}') }
+        return ids
+
+    def _cache_add(self, table: str, ids) -> None:
+        '''
+        Adds ids to the cached id set of a table, if it has been read.
+
+        Parameters
+        ----------
+        table (str) : the name of the table.
+        ids (iterable) : the ids added to the table.
+        '''
+        if table in self._ids:
+            self._ids[table].update(ids)
+
+    def _cache_discard(self, table: str, item_id: str) -> None:
+        '''
+        Removes an id from the cached id set of a table, if it has been read.
+
+        Parameters
+        ----------
+        table (str) : the name of the table.
+        item_id (str) : the id removed from the table.
+        '''
+        if table in self._ids:
+            self._ids[table].discard(item_id)
+
     def nodes(self) -> set:
         '''
         Returns the set of all node_ids in the database.
         '''
-        return { tup[0] for tup in self.cursor.execute('select node_id from nodes').fetchall() }
+        return set(self._cached_ids('nodes', 'node_id'))
 
     def links(self) -> set:
         '''
         Returns the set of all link_ids in the database.
         '''
-        return { tup[0] for tup in self.cursor.execute('select link_id from links').fetchall() }
+        return set(self._cached_ids('links', 'link_id'))
   
     def references(self) -> set:
         '''
         Returns the set of all ref_ids in the database.
         '''
-        return { tup[0] for tup in self.cursor.execute('select ref_id from sources').fetchall() }
+        return set(self._cached_ids('sources', 'ref_id'))
+
+    def has_reference(self, ref_id: str) -> bool:
+        '''
+        Returns True if a Reference with the given ref_id is in the database, using the id cache
+        shared by every DB on the same connection.
+
+        Parameters
+        ----------
+        ref_id (str) : the id of the Reference.
+        '''
+        return ref_id in self._cached_ids('sources', 'ref_id')
+
+    def positions(self) -> dict:
+        '''
+        Returns the cached drawing positions as a dict of node_id -> (x, y).
+        '''
+        return { tup[0] : tup[1:] for tup in self.cursor.execute('select * from positions') }
+
+    def set_positions(self, positions: dict) -> None:
+        '''
+        Caches drawing positions for Nodes in the database.
+
+        Parameters
+        ----------
+        positions (dict) : a dict of node_id -> (x, y).
+        '''
+        with self.con:
+            self.cursor.executemany('insert or replace into positions values (?, ?, ?)',
+                [(node_id, float(x), float(y)) for node_id, (x, y) in positions.items()])
 
     def export_data_files(self, tmp_path: Path):
         '''
         Writes the model data files to .csv files in the tmp_path folder.
         '''
-        with open(tmp_path.joinpath('nodes.csv'), 'w') as f:
-            writer = csv.writer(f)
-            nodes = self.cursor.execute('select * from nodes').fetchall()
-            for node in nodes:
-                writer.writerow(node)
-        with open(tmp_path.joinpath('links.csv'), 'w') as f:
-            writer = csv.writer(f)
-            links = self.cursor.execute('select * from links').fetchall()
-            for link in links:
-                writer.writerow(link)
-        with open(tmp_path.joinpath('references.csv'), 'w') as f:
-            writer = csv.writer(f)
-            refs = self.cursor.execute('select * from sources').fetchall()
-            for ref in refs:
-                writer.writerow(ref)
-        shutil.copyfile(self.file_path, tmp_path.joinpath(self.file_path.name))
+        with open(tmp_path.joinpath('nodes.csv'), 'w', newline='', buffering=1 << 20) as f:
+            csv.writer(f).writerows(self.cursor.execute('select * from nodes'))
+        with open(tmp_path.joinpath('links.csv'), 'w', newline='', buffering=1 << 20) as f:
+            csv.writer(f).writerows(self.cursor.execute('select * from links'))
+        with open(tmp_path.joinpath('references.csv'), 'w', newline='', buffering=1 << 20) as f:
+            csv.writer(f).writerows(self.cursor.execute('select * from sources'))
+        dst = sqlite3.connect(tmp_path.joinpath(self.file_path.name))
+        try:
+            self.con.backup(dst)
+        finally:
+            dst.close()
 
     def clear(self):
         '''
-        Clears the database of all Nodes, Links and References.
+        Clears the database of all Nodes, Links, References and cached positions.
         '''
-        self.cursor.execute('drop table if exists nodes')
-        self.cursor.execute('drop table if exists links')
-        self.cursor.execute('drop table if exists sources')
-        self.create_tables()
\ No newline at end of file
+        self.cursor.executescript('''
+            begin;
+            drop table if exists nodes;
+            drop table if exists links;
+            drop table if exists sources;
+            drop table if exists positions;
+        ''' + DB._SQL_CREATE_TABLES + 'commit;')
+        self._ids.clear()
\ No newline at end of file
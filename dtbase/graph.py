@@ -1,5 +1,4 @@
-import csv, shutil, tempfile
-import matplotlib.pyplot as plt
+import csv, tempfile, zipfile
 import networkx as nx
 from pathlib import Path
 from dtbase.data import DB
@@ -16,7 +15,10 @@ class Model:
     ----------
     graph (nx.MultiDiGraph) : a directed acyclic graph representing the causal model.
     db (model.db) : a db object to access and modify the database.
+    cache_size (int) : the maximum number of Nodes, Links and References each kept by the lookup caches.
     '''
+    cache_size = 4096
+
     def __init__(self, file_path: str=None):
         '''
         Constructs a DTBase model object.
@@ -25,28 +27,67 @@ class Model:
         ----------
         file_path (str) : a file path for the database file.
         '''
-        self.graph = nx.MultiDiGraph()
+        # the graph is built from the database on first access, see the graph property
+        self._graph = None
+        # link_id -> (parent_id, child_id, edge_key) of every edge in the graph
+        self._link_index = {}
+        # id -> object caches for get_node, get_link and get_reference
+        self._node_cache = {}
+        self._link_cache = {}
+        self._ref_cache = {}
         if not file_path:
-            file_path = ':memory'
+            file_path = ':memory:'
         self.db = DB(file_path)
-        self.build_graph()
+
+    @property
+    def graph(self) -> nx.MultiDiGraph:
+        '''
+        The graph of the model, built from the database the first time it is needed.
+        '''
+        if self._graph is None:
+            self.build_graph()
+        return self._graph
 
     def build_graph(self):
         '''
         Builds a graph from the links and nodes database contents.
         '''
-        self.graph.clear()
-        for node_id in self.nodes():
-            self.graph.add_node(node_id)
-        for link_id in self.links():
-            link = self.get_link(link_id)
-            self.graph.add_edge(link.parent_id, link.child_id, key=link.edge_key, link_id=link.link_id)
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from(self.db.nodes())
+        endpoints = self.db.link_endpoints()
+        graph.add_edges_from((parent_id, child_id, edge_key, { 'link_id' : link_id })
+            for link_id, parent_id, child_id, edge_key in endpoints)
+        link_index = { link_id : (parent_id, child_id, edge_key)
+            for link_id, parent_id, child_id, edge_key in endpoints }
+        self._graph = graph
+        self._link_index = link_index
 
-    def draw(self) -> None:
-        '''
-        Draws a visual representation of the graph.
+    def draw(self, file_path: str=None) -> None:
         '''
-        nx.draw_spring(self.graph, with_labels=True, node_size=750)
+        Draws a visual representation of the graph. Node positions are cached in the
+        database so only Nodes added since the last drawing need to be laid out.
+
+        Parameters
+        ----------
+        file_path (str) : if given, the drawing is saved to this file path instead of being
+            drawn on the current pyplot figure.
+        '''
+        pos = { node_id : xy for node_id, xy in self.db.positions().items() if node_id in self.graph }
+        if len(pos) < len(self.graph):
+            if pos:
+                new_pos = nx.spring_layout(self.graph, pos=pos, fixed=list(pos), iterations=5)
+            else:
+                new_pos = nx.spring_layout(self.graph)
+            self.db.set_positions({ node_id : xy for node_id, xy in new_pos.items() if node_id not in pos })
+            pos = new_pos
+        if file_path:
+            # draw off-screen on a Figure that pyplot does not track, so it is freed after saving
+            from matplotlib.figure import Figure
+            fig = Figure()
+            nx.draw(self.graph, pos=pos, ax=fig.add_subplot(), with_labels=True, node_size=750)
+            fig.savefig(file_path)
+        else:
+            nx.draw(self.graph, pos=pos, with_labels=True, node_size=750)
 
     def add_node(self, node: Node) -> None:
         '''
@@ -56,12 +97,27 @@ class Model:
         ----------
         node (Node) : the node to add to the model.
         '''
-        if self.db.get_node(node.node_id):
-            raise ValueError(f'[{node.node_id}] already exists in the model.')
-        elif not isinstance(node, Node):
-            raise TypeError(f'expected [dtbase.node], found [{type(node)}]')
-        self.db.add_node(node=node)
-        self.graph.add_node(node.node_id)
+        self.add_nodes([node])
+
+    def add_nodes(self, nodes: list) -> None:
+        '''
+        Adds a list of Nodes to the model in a single database transaction.
+
+        Parameters
+        ----------
+        nodes (list) : the Nodes to add to the model.
+        '''
+        nodes = list(nodes)
+        graph = self.graph
+        node_ids = set()
+        for node in nodes:
+            if node.node_id in graph or node.node_id in node_ids:
+                raise ValueError(f'[{node.node_id}] already exists in the model.')
+            elif not isinstance(node, Node):
+                raise TypeError(f'expected [dtbase.node], found [{type(node)}]')
+            node_ids.add(node.node_id)
+        self.db.add_nodes(nodes)
+        graph.add_nodes_from(node_ids)
     
     def add_link(self, link: Link) -> None:
         '''
@@ -71,17 +127,41 @@ class Model:
         ----------
         link (Link) : the Link to add to the model.
         '''
-        if self.db.get_link(link.link_id):
-            raise ValueError(f'[{link.link_id}] already exists in the model.')
-        elif not isinstance(link, Link):
-            raise TypeError(f'expected [dtbase.link], found [{type(link)}]')
-        elif not self.get_node(link.child_id):
-            raise ValueError(f'Node [{link.child_id}] does not exist in the model.')
-        elif not self.get_node(link.child_id):
-            raise ValueError(f'Node [{link.parent_id}] does not exist in the model.')
-        link.edge_key = self.graph.new_edge_key(link.parent_id, link.child_id)
-        self.graph.add_edge(link.parent_id, link.child_id, key=link.edge_key, link_id=link.link_id)
-        self.db.add_link(link)
+        self.add_links([link])
+
+    def add_links(self, links: list) -> None:
+        '''
+        Adds a list of Links to the model in a single database transaction.
+
+        Parameters
+        ----------
+        links (list) : the Links to add to the model.
+        '''
+        links = list(links)
+        graph = self.graph
+        link_ids = set()
+        for link in links:
+            if link.link_id in self._link_index or link.link_id in link_ids:
+                raise ValueError(f'[{link.link_id}] already exists in the model.')
+            elif not isinstance(link, Link):
+                raise TypeError(f'expected [dtbase.link], found [{type(link)}]')
+            elif link.child_id not in graph:
+                raise ValueError(f'Node [{link.child_id}] does not exist in the model.')
+            elif link.parent_id not in graph:
+                raise ValueError(f'Node [{link.parent_id}] does not exist in the model.')
+            link_ids.add(link.link_id)
+        for link in links:
+            link.edge_key = graph.new_edge_key(link.parent_id, link.child_id)
+            graph.add_edge(link.parent_id, link.child_id, key=link.edge_key, link_id=link.link_id)
+            self._link_index[link.link_id] = (link.parent_id, link.child_id, link.edge_key)
+        try:
+            self.db.add_links(links)
+        except Exception:
+            # the insert was rolled back, so undo the graph and link index edits too
+            for link in links:
+                graph.remove_edge(link.parent_id, link.child_id, link.edge_key)
+                del self._link_index[link.link_id]
+            raise
     
     def add_reference(self, reference: Reference) -> None:
         '''
@@ -91,12 +171,25 @@ class Model:
         ----------
         reference (Reference) : the Reference to add to the model.
         '''
-        if self.db.get_reference(reference.ref_id):
-            print(self.db.get_reference(reference.ref_id))
-            raise ValueError(f'[{reference.ref_id}] already exists in the model.')
-        elif not isinstance(reference, Reference):
-            raise TypeError(f'link expected [dtbase.reference], found [{type(reference)}]')
-        self.db.add_reference(reference)
+        self.add_references([reference])
+
+    def add_references(self, references: list) -> None:
+        '''
+        Adds a list of References to the model in a single database transaction.
+
+        Parameters
+        ----------
+        references (list) : the References to add to the model.
+        '''
+        references = list(references)
+        ref_ids = set()
+        for reference in references:
+            if reference.ref_id in ref_ids or self.db.has_reference(reference.ref_id):
+                raise ValueError(f'[{reference.ref_id}] already exists in the model.')
+            elif not isinstance(reference, Reference):
+                raise TypeError(f'link expected [dtbase.reference], found [{type(reference)}]')
+            ref_ids.add(reference.ref_id)
+        self.db.add_references(references)
 
     def get_node(self, node_id: str) -> Node:
         '''
@@ -106,9 +199,12 @@ class Model:
         ----------
         node_id (str) : the node_id of the Node to retrieve from the model.
         '''
-        node = self.db.get_node(node_id)
-        if not node:
-            raise KeyError(f'Node [{node_id}] does not exist in the model.')
+        node = Model._cache_get(self._node_cache, node_id)
+        if node is None:
+            node = self.db.get_node(node_id)
+            if not node:
+                raise KeyError(f'Node [{node_id}] does not exist in the model.')
+            Model._cache_put(self._node_cache, node_id, node)
         return node
 
     def get_link(self, link_id: str) -> Link:
@@ -119,10 +215,14 @@ class Model:
         ----------
         link_id (str) : the link_id of the Link to retrieve from the model.
         '''
-        link = self.db.get_link(link_id)
-        if not link:
-            raise KeyError(f'Link [{link_id}] does not exist in the model.')
-        return link
+        link = Model._cache_get(self._link_cache, link_id)
+        if link is None:
+            link = self.db.get_link(link_id)
+            if not link:
+                raise KeyError(f'Link [{link_id}] does not exist in the model.')
+            Model._cache_put(self._link_cache, link_id, link)
+        # the cached Link never draws samples, callers get a copy with their own Estimates
+        return link.copy()
 
     def get_reference(self, ref_id: str) -> Reference:
         '''
@@ -132,11 +232,45 @@ class Model:
         ----------
         ref_id (str) : the ref_id of the Reference to retrieve from the model.
         '''
-        ref = self.db.get_reference(ref_id)
-        if not ref:
-            raise KeyError(f'Reference [{ref_id}] does not exist in the model.')
+        ref = Model._cache_get(self._ref_cache, ref_id)
+        if ref is None:
+            ref = self.db.get_reference(ref_id)
+            if not ref:
+                raise KeyError(f'Reference [{ref_id}] does not exist in the model.')
+            Model._cache_put(self._ref_cache, ref_id, ref)
         return ref
 
+    @staticmethod
+    def _cache_get(cache: dict, key: str):
+        '''
+        Returns a value from a lookup cache, or None if it is not cached, marking it as the most recently used.
+
+        Parameters
+        ----------
+        cache (dict) : the lookup cache.
+        key (str) : the id of the cached object.
+        '''
+        value = cache.pop(key, None)
+        if value is not None:
+            cache[key] = value
+        return value
+
+    @staticmethod
+    def _cache_put(cache: dict, key: str, value) -> None:
+        '''
+        Stores a value in a lookup cache, evicting the least recently used entry once the cache holds
+        cache_size entries.
+
+        Parameters
+        ----------
+        cache (dict) : the lookup cache.
+        key (str) : the id of the cached object.
+        value (object) : the cached object.
+        '''
+        if len(cache) >= Model.cache_size:
+            del cache[next(iter(cache))]
+        cache[key] = value
+
     def remove_node(self, node_id: str) -> None:
         '''
         Removes a Node with a given id from the model if it exists. Otherwise, raises a KeyError.
@@ -145,7 +279,14 @@ class Model:
         ----------
         node_id (str) : the node_id of the Node to remove from the model.
         '''
-        if self.db.get_node(node_id):
+        if node_id in self.graph:
+            for _, _, link_id in self.graph.in_edges(node_id, data='link_id'):
+                self._link_index.pop(link_id, None)
+                self._link_cache.pop(link_id, None)
+            for _, _, link_id in self.graph.out_edges(node_id, data='link_id'):
+                self._link_index.pop(link_id, None)
+                self._link_cache.pop(link_id, None)
+            self._node_cache.pop(node_id, None)
             self.graph.remove_node(node_id)
             self.db.remove_node(node_id)
             return
@@ -159,9 +300,11 @@ class Model:
         ----------
         link_id (str) : the link_id of the Link to remove from the model.
         '''
-        link = self.db.get_link(link_id)
-        if link:
-            self.graph.remove_edge(link.parent_id, link.child_id, link.edge_key)
+        graph = self.graph
+        if link_id in self._link_index:
+            parent_id, child_id, edge_key = self._link_index.pop(link_id)
+            graph.remove_edge(parent_id, child_id, edge_key)
+            self._link_cache.pop(link_id, None)
             self.db.remove_link(link_id)
             return
         raise KeyError(f'Link [{link_id}] does not exist in the model.')
@@ -174,8 +317,14 @@ class Model:
         ----------
         ref_id (str) : the ref_id of the Reference to remove from the model.
         '''
-        if self.db.get_reference(ref_id):
+        if self.db.has_reference(ref_id):
+            # the Links supported by the Reference are removed along with it
+            graph = self.graph
+            for link_id in self.db.reference_links(ref_id):
+                graph.remove_edge(*self._link_index.pop(link_id))
+                self._link_cache.pop(link_id, None)
             self.db.remove_reference(ref_id)
+            self._ref_cache.pop(ref_id, None)
             return
         raise KeyError(f'Reference [{ref_id}] does not exist in the model.')
 
@@ -191,6 +340,14 @@ class Model:
         '''
         return self.db.links()
 
+    def number_of_links(self) -> int:
+        '''
+        Returns the number of Links in the model without querying the database.
+        '''
+        if self._graph is None:
+            self.build_graph()
+        return len(self._link_index)
+
     def references(self) -> set:
         '''
         Returns the set of all the ref_ids in the model.
@@ -202,18 +359,30 @@ class Model:
         Clears the entire model, including all Nodes, Links, and References.
         '''
         self.db.clear()
-        self.graph.clear()
+        self._graph = nx.MultiDiGraph()
+        self._link_index = {}
+        self._node_cache.clear()
+        self._link_cache.clear()
+        self._ref_cache.clear()
 
     def export_model(self, name: str) -> None:
         '''
         Creates a .zip file with all the model data
+
+        Parameters
+        ----------
+        name (str) : the path of the archive to create, with or without the .zip extension.
         '''
+        base = name[:-4] if name.endswith('.zip') else name
         with tempfile.TemporaryDirectory() as tmpdir:
             path = Path(tmpdir)
             self.db.export_data_files(path)
-            self.draw()
-            plt.savefig(path.joinpath(Path('model.png')))
-            shutil.make_archive(name, 'zip', path)
+            self.draw(path.joinpath('model.png'))
+            with zipfile.ZipFile(f'{base}.zip', 'w') as archive:
+                for file in sorted(path.iterdir()):
+                    # the png is already compressed, so store it as is
+                    compression = zipfile.ZIP_STORED if file.suffix == '.png' else zipfile.ZIP_DEFLATED
+                    archive.write(file, file.name, compress_type=compression)
 
     def import_nodes(self, file_path: str) -> None:
         '''
@@ -225,8 +394,7 @@ class Model:
         '''
         with open (file_path, 'r') as f:
             reader = csv.reader(f)
-            for node in reader:
-                self.add_node(Node(*node))
+            self.add_nodes([Node(*node) for node in reader])
 
     def import_refs(self, file_path: str) -> None:
         '''
@@ -238,11 +406,13 @@ class Model:
         '''
         with open (file_path, 'r') as f:
             reader = csv.reader(f)
+            refs = []
             for node in reader:
                 try:
-                    self.add_reference(Reference(*node))
+                    refs.append(Reference(*node))
                 except KeyError:
                     continue
+            self.add_references(refs)
 
     def import_links(self, file_path: str) -> None:
         '''
@@ -252,13 +422,8 @@ class Model:
         ----------
         file_path (str) : a file path that points to a properly formatted .csv file.
         '''
-        with open (file_path, 'r') as f:
-            reader = csv.reader(f)
-            for link in reader:
-                # read estimates
-                i = 3
-                m = []
-                while i < 12:
-                    m.append(Estimate(EstimateTypes(link[i]), float(link[i + 1]), float(link[i + 2])))
-                    i += 3
-                self.add_link(Link(*link[0:3], *m, *link[12:]))
+        with open (file_path, 'r', newline='') as f:
+            # the m1, m2 and m3 Estimates are stored as (type, a, b) in columns 3-11
+            self.add_links([Link(*link[0:3],
+                *(Estimate(EstimateTypes(link[i]), float(link[i + 1]), float(link[i + 2])) for i in (3, 6, 9)),
+                *link[12:]) for link in csv.reader(f)])
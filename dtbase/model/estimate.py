@@ -1,6 +1,5 @@
 import numpy as np
 from enum import Enum, auto
-from scipy.stats import norm
 
 class EstimateTypes(Enum):
     '''
@@ -9,6 +8,14 @@ class EstimateTypes(Enum):
     UNIFORM='UNIFORM'
     NORMAL='NORMAL'
 
+# EstimateTypes by value, avoiding the Enum lookup machinery when reading rows
+_ETYPES = { estimate_type.value : estimate_type for estimate_type in EstimateTypes }
+
+# one random number generator shared by all Estimates
+_RNG = np.random.default_rng()
+# z-score of the 95th percentile of the standard normal distribution, i.e. norm.ppf(.95)
+_Z95 = 1.6448536269514722
+
 class Estimate:
     '''
     Uses sampling to propagate uncertainty in an Estimate.
@@ -20,37 +27,148 @@ class Estimate:
     a (float) : alpha parameter for the distribution.
     b (float) : beta parameter for the distribution.
     sample_size (int) : the sample size to generate.
-    sample (np.array) : a numpy array with the sample
+    dtype (np.dtype) : the floating point type of the sample.
+    sample (np.array) : a numpy array with the sample, drawn on first access.
     '''
+    __slots__ = ('estimate_type', 'rng', 'a', 'b', '_sample')
     sample_size = int(1e5)
+    dtype = np.float32
 
     def __init__(self, estimate_type: EstimateTypes, a: float, b: float):
         '''
         Constructs an Estimate object.
         '''
         self.estimate_type = estimate_type
-        self.rng = np.random.default_rng()
+        self.rng = _RNG
         self.a = a
         self.b = b
-        if self.estimate_type == EstimateTypes.NORMAL:
-            self.sample = self.normal()
-        elif self.estimate_type == EstimateTypes.UNIFORM:
-            self.sample = self.uniform()
+        self._sample = None
+
+    @property
+    def sample(self) -> np.array:
+        '''
+        Returns the sample of the Estimate, drawing it on first access.
+        '''
+        if self._sample is None:
+            if self.estimate_type == EstimateTypes.NORMAL:
+                self._sample = self.normal()
+            elif self.estimate_type == EstimateTypes.UNIFORM:
+                self._sample = self.uniform()
+        return self._sample
+
+    @staticmethod
+    def seed(seed: int) -> None:
+        '''
+        Reseeds the random number generator shared by all Estimates, making the samples drawn
+        afterwards reproducible.
+
+        Parameters
+        ----------
+        seed (int or np.random.SeedSequence) : the seed for the random number generator.
+        '''
+        _RNG.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+
+    @staticmethod
+    def spawn_seeds(n: int) -> list:
+        '''
+        Returns n independent np.random.SeedSequences drawn from the shared random number generator,
+        for seeding Estimates in other processes. The seeds are reproducible after Estimate.seed.
+
+        Parameters
+        ----------
+        n (int) : the number of seeds.
+        '''
+        return np.random.SeedSequence(int(_RNG.integers(2**63))).spawn(n)
+
+    def reset(self) -> None:
+        '''
+        Discards the drawn sample, so a new one is drawn on the next access.
+        '''
+        self._sample = None
+
+    @classmethod
+    def from_row(cls, row, prefix: str) -> 'Estimate':
+        '''
+        Constructs an Estimate from the <prefix>_type, <prefix>_a and <prefix>_b columns of a row.
+
+        Parameters
+        ----------
+        row (sqlite3.Row) : a database row holding the Estimate.
+        prefix (str) : the column prefix of the Estimate, e.g. 'm1'.
+        '''
+        return cls(_ETYPES[row[f'{prefix}_type']], row[f'{prefix}_a'], row[f'{prefix}_b'])
 
     def uniform(self) -> np.array:
         '''
         Sampling function for a uniform distribution with (a, b) being the min and max parameters.
         '''
-        return self.rng.uniform(self.a, self.b, Estimate.sample_size)
+        sample = self.rng.random(Estimate.sample_size, dtype=Estimate.dtype)
+        sample *= self.b - self.a
+        sample += self.a
+        return sample
     
     def normal(self) -> np.array:
         '''
         Sampling function for a normal distribution with (a, b) being a 95% confidence interval.
         '''
-        mp = (self.b - self.a) / 2
-        z = norm.ppf(.95)
-        sd = (self.b - mp) / z
-        return self.rng.normal(mp, sd, Estimate.sample_size)
+        mp = (self.a + self.b) / 2
+        sd = (self.b - mp) / _Z95
+        sample = self.rng.standard_normal(Estimate.sample_size, dtype=Estimate.dtype)
+        sample *= sd
+        sample += mp
+        return sample
+
+    @staticmethod
+    def batch_sample(types: list, a: np.array, b: np.array) -> np.array:
+        '''
+        Returns an (N, sample_size) array with one sample per row, drawn for N Estimates at once
+        with a single RNG call per EstimateType.
+
+        Parameters
+        ----------
+        types (list) : the EstimateTypes of the N Estimates.
+        a (np.array) : the alpha parameters of the N Estimates.
+        b (np.array) : the beta parameters of the N Estimates.
+        '''
+        a = np.asarray(a, dtype=float)
+        b = np.asarray(b, dtype=float)
+        out = np.empty((len(types), Estimate.sample_size), dtype=Estimate.dtype)
+        normal = np.fromiter((t == EstimateTypes.NORMAL for t in types), dtype=bool, count=len(types))
+        for mask in (normal, ~normal):
+            if not mask.any():
+                continue
+            # draw straight into out when every Estimate has this type, and scale in place
+            block = out if mask.all() else np.empty((np.count_nonzero(mask), Estimate.sample_size), dtype=Estimate.dtype)
+            if mask is normal:
+                _RNG.standard_normal(dtype=Estimate.dtype, out=block)
+                loc = (a[mask] + b[mask]) / 2
+                scale = (b[mask] - loc) / _Z95
+            else:
+                _RNG.random(dtype=Estimate.dtype, out=block)
+                loc = a[mask]
+                scale = b[mask] - loc
+            block *= scale[:, None]
+            block += loc[:, None]
+            if block is not out:
+                out[mask] = block
+        return out
+
+    @staticmethod
+    def sample_all(estimates: list) -> None:
+        '''
+        Draws the samples of every Estimate in a list that has not been sampled yet using batch_sample.
+
+        Parameters
+        ----------
+        estimates (list) : a list of Estimate objects.
+        '''
+        pending = [estimate for estimate in estimates if estimate._sample is None]
+        if not pending:
+            return
+        samples = Estimate.batch_sample([estimate.estimate_type for estimate in pending],
+            [estimate.a for estimate in pending], [estimate.b for estimate in pending])
+        for estimate, sample in zip(pending, samples):
+            estimate._sample = sample
 
     def to_tuple(self) -> tuple:
         '''
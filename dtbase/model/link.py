@@ -18,6 +18,9 @@ class Link:
     ref_id (str) : the unique id of the Reference which supports the claim of a causal link.
     edge_key (int) : the integer key used internally to handle multiple edges between nodes.
     '''
+    __slots__ = ('link_id', 'parent_id', 'child_id', 'm1', 'm2', 'm3',
+        'm1_memo', 'm2_memo', 'm3_memo', 'ref_id', '_edge_key', '_hash')
+
     def __init__(self, link_id: str, parent_id: str, child_id: str, 
             m1: Estimate, m2: Estimate, m3: Estimate,
             m1_memo: str = None, m2_memo: str = None, m3_memo: str = None,
@@ -28,9 +31,9 @@ class Link:
         if not isinstance(m1, Estimate):
             raise TypeError('m1 must be an Estimate object.')
         if not isinstance(m2, Estimate):
-            raise TypeError('m1 must be an Estimate object.')
-        if not isinstance(m2, Estimate):
-            raise TypeError('m1 must be an Estimate object.')
+            raise TypeError('m2 must be an Estimate object.')
+        if not isinstance(m3, Estimate):
+            raise TypeError('m3 must be an Estimate object.')
 
         self.link_id = link_id
         self.parent_id = parent_id
@@ -44,6 +47,31 @@ class Link:
         self.ref_id = ref_id
         self.edge_key = edge_key
 
+    @property
+    def edge_key(self) -> int:
+        '''
+        The integer key used internally to handle multiple edges between nodes.
+        '''
+        return self._edge_key
+
+    @edge_key.setter
+    def edge_key(self, edge_key: int) -> None:
+        '''
+        Sets the edge_key and updates the cached hash of the Link.
+        '''
+        self._edge_key = edge_key
+        self._hash = hash((self.child_id, self.parent_id, edge_key))
+
+    def copy(self) -> 'Link':
+        '''
+        Returns a copy of the Link with new Estimates that have not drawn their samples yet.
+        '''
+        return Link(self.link_id, self.parent_id, self.child_id,
+            Estimate(self.m1.estimate_type, self.m1.a, self.m1.b),
+            Estimate(self.m2.estimate_type, self.m2.a, self.m2.b),
+            Estimate(self.m3.estimate_type, self.m3.a, self.m3.b),
+            self.m1_memo, self.m2_memo, self.m3_memo, self.ref_id, self.edge_key)
+
     def to_tuple(self) -> tuple:
         '''
         Returns a tuple representation of a Link.
@@ -56,4 +84,4 @@ class Link:
         '''
         Returns a hash of a Link based on the parent_id, child_id and edge_key.
         '''
-        return hash((self.child_id, self.parent_id, self.edge_key))
\ No newline at end of file
+        return self._hash
\ No newline at end of file
@@ -1,3 +1,5 @@
+import sys
+
 class Node:
     '''
     Represents a Node in the DT-BASE causal model.
@@ -8,13 +10,17 @@ class Node:
     name (str) : the name of the Node.
     keywords (str) : a string of space separated keywords to tag a Node.
     '''
+    __slots__ = ('node_id', 'name', 'keywords', '_hash')
+
     def __init__(self, node_id: str, name: str=None, keywords: str=None):
         '''
         Constructs a Node object.
         '''
         self.name = name
-        self.keywords = keywords
+        # keyword strings repeat across nodes, so share one copy of each
+        self.keywords = sys.intern(keywords) if isinstance(keywords, str) else keywords
         self.node_id = node_id
+        self._hash = hash(node_id)
 
     def to_tuple(self) -> tuple:
         '''
@@ -24,6 +30,6 @@ class Node:
 
     def __hash__(self) -> int:
         '''
-        Returns a hash of a Node based on its name and keywords.
+        Returns a hash of a Node based on its node_id, computed on construction.
         '''
-        return hash((self.name, self.keywords))
\ No newline at end of file
+        return self._hash
\ No newline at end of file
@@ -1,3 +1,5 @@
+import sys
+
 class Reference:
     '''
     Object representing a Reference in the DT-BASE model.
@@ -10,6 +12,8 @@ class Reference:
     publication_type (str) : the type of publication. Must be a valid .ris "TY" tag value.
     publisher (str) :the name of the publisher.
     '''
+    __slots__ = ('ref_id', 'title', 'year', 'authors', 'publication_type', 'publisher', '_hash')
+
     def __init__(self, ref_id:str, title: str, year: str = None, authors: list = None,
         publication_type: str = None, publisher: str = None):
         ''''
@@ -20,8 +24,10 @@ class Reference:
         self.title = title
         self.year = year
         self.authors = authors
-        self.publication_type = publication_type
-        self.publisher = publisher
+        # a model cites few distinct publishers and publication types, interned to one string per value
+        self.publication_type = sys.intern(publication_type) if isinstance(publication_type, str) else publication_type
+        self.publisher = sys.intern(publisher) if isinstance(publisher, str) else publisher
+        self._hash = hash((title, tuple(authors) if isinstance(authors, list) else authors))
     
     def to_tuple(self) -> tuple:
         '''
@@ -31,6 +37,6 @@ class Reference:
 
     def __hash__(self) -> int:
         '''
-        Returns a hash of a reference based on the title and authors.
+        Returns a hash of a reference based on the title and authors, computed on construction.
         '''
-        return hash((self.title, self.authors))
\ No newline at end of file
+        return self._hash
\ No newline at end of file
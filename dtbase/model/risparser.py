@@ -1,6 +1,12 @@
 from dtbase.model.reference import Reference
 from RISparser import readris
 
+# .ris fields holding each Reference attribute, in order of preference
+TITLE_KEYS = ('title', 'primary_title')
+AUTHORS_KEYS = ('authors', 'first_authors')
+PUBLISHER_KEYS = ('publisher', 'journal_name', 'original_publication')
+YEAR_KEYS = ('year', 'publication_year')
+
 class risparser:
     '''
     Parses ris files into Reference objects:
@@ -24,27 +30,27 @@ class risparser:
         Parses a .RIS file into a list of ref_ objects, one for each entry.
         '''
         out = []
-        with open (self.file_path, 'r') as ris:
-            entries = readris(ris)
-            i = 0
-            for entry in entries:
-                type_ = entry['type_of_reference'] if 'type_of_reference' in entry else None
-                title_ = entry['title'] if 'title' in entry \
-                    else entry['primary_title'] if 'primary_title' in entry \
-                    else None
-                authors_= entry['authors'] if 'authors' in entry \
-                    else entry['first_authors'] if 'first_authors' in entry \
-                    else None
-                publisher_ = entry['publisher'] if 'publisher' in entry \
-                    else entry['journal_name'] if 'journal_name' in entry \
-                    else entry['original_publication'] if 'original_publication' in entry \
-                    else None
-                year_ = entry['year'] if 'year' in entry \
-                    else entry['publication_year'] if 'publication_year' in entry \
-                    else None
-                if i >= len(self.ids):
-                    raise ValueError('The length of the ref_id list provided \
-                        must match the number of entries in [{ris_file}].')
-                out.append(Reference(self.ids[i], title_, year_ , str(authors_), type_, publisher_))
-                i += 1
-        return out
\ No newline at end of file
+        n_ids = len(self.ids)
+        with open (self.file_path, 'r', buffering=1 << 20) as ris:
+            for i, entry in enumerate(readris(ris)):
+                if i >= n_ids:
+                    raise ValueError('The length of the ref_id list provided '
+                        f'must match the number of entries in [{self.file_path}].')
+                out.append(Reference(self.ids[i], first(entry, TITLE_KEYS), first(entry, YEAR_KEYS),
+                    str(first(entry, AUTHORS_KEYS)), entry.get('type_of_reference'), first(entry, PUBLISHER_KEYS)))
+        return out
+
+def first(entry: dict, keys: tuple):
+    '''
+    Returns the value of the first key in keys that is present in a .ris entry, or None.
+
+    Parameters
+    ----------
+    entry (dict) : a .ris entry parsed by readris.
+    keys (tuple) : the .ris field names to try, in order of preference.
+    '''
+    for key in keys:
+        value = entry.get(key)
+        if value is not None:
+            return value
+    return None
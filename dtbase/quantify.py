@@ -1,12 +1,21 @@
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from enum import Enum
-from itertools import combinations
+from functools import lru_cache
+from itertools import combinations, repeat
+import math
+import os
 import numpy as np
+from dtbase.data import DB
 from dtbase.graph import Model
+from dtbase.model.estimate import Estimate
 
 # default sample size for the Monte Carlo method
 sample_size = int(1e5)
+# (mean, std) record of a CPT entry
+CPT_DTYPE = np.dtype([('mean', 'f8'), ('std', 'f8')])
+# lower bound for log(1 - P), exp(LOG_FLOOR) underflows to 0 in double precision
+LOG_FLOOR = -800.0
 
 class AggregationMethod(Enum):
     '''
@@ -15,11 +24,11 @@ class AggregationMethod(Enum):
     ARITHMETIC=0,
     GEOMETRIC=1
 
-def calculate(model: Model, target_node: str, ag_method: AggregationMethod) -> defaultdict:
+def calculate(model: Model, target_node: str, ag_method: AggregationMethod) -> dict:
     '''
-    Returns a defaultdict representing the conditional probability table for a target_node.
-    Each key in the defaultdict is a tuple of parent nodes.
-    Each value is P(target_node | parents).
+    Returns a dict representing the conditional probability table for a target_node.
+    Each key in the dict is a tuple of parent nodes.
+    Each value is the (mean, std) of P(target_node | parents).
 
     Parameters
     ----------
@@ -27,80 +36,279 @@ def calculate(model: Model, target_node: str, ag_method: AggregationMethod) -> d
     target_node(str) : the node_id of the target node.
     ag_method (AggregationMethod) : the enum value representing the type of AggregationMethod to use.
     '''
-    if ag_method == AggregationMethod.ARITHMETIC:
-        aggregated_cp = calc_cp_arithmetic(model, target_node, calc_normalized_weights(model, target_node))
-    elif ag_method == AggregationMethod.GEOMETRIC:
-        aggregated_cp = calc_cp_geometric(model, target_node, calc_normalized_weights(model, target_node))
-
-    cpt = defaultdict(lambda: np.zeros(sample_size))
-    pred = set(model.graph.predecessors(target_node))
-    for i in range(1, len(pred) + 1):
-        for combo in combinations(pred, i):
-            c = calc_noisy_or(aggregated_cp, combo)
-            cpt[combo] = (np.mean(c), np.std(c))
+    cpt = {}
+    pred = list(model.graph.predecessors(target_node))
+    if not pred:
+        return cpt
+    aggregated_cp = _AGGREGATORS[ag_method](model, target_node, calc_normalized_weights(model, target_node))
+
+    # parents with a zero probability contribute a factor of 1 to the noisy or product,
+    # so subsets are only enumerated over the remaining active parents
+    active = [parent_id for parent_id in pred if np.any(aggregated_cp[parent_id])]
+    active_bits = { parent_id : 1 << j for j, parent_id in enumerate(active) }
+    # the bit of each parent in the active subset bitmask, 0 for inactive parents
+    pred_bits = [active_bits.get(parent_id, 0) for parent_id in pred]
+    subsets = calc_noisy_or_subsets(aggregated_cp, active)
+    for combo in parent_subsets(len(pred)):
+        mask = sum(pred_bits[j] for j in combo)
+        cpt[tuple(pred[j] for j in combo)] = (subsets['mean'][mask], subsets['std'][mask])
     return cpt
 
-def calc_normalized_weights(model: Model, target_node: str) -> defaultdict:
+def calculate_many(model: Model, target_nodes: list, ag_method: AggregationMethod, workers: int=None) -> dict:
+    '''
+    Returns a dict of target node_id -> conditional probability table, as returned by calculate,
+    for every node in target_nodes. The targets are quantified in parallel worker processes,
+    each opening its own connection to the model's database file. Models held in memory
+    cannot be shared between processes and are quantified sequentially. Each target is quantified
+    with its own seed from Estimate.spawn_seeds, so the workers draw independent samples and the
+    results do not depend on how the targets are scheduled.
+
+    Parameters
+    ----------
+    model (DTBase) : the DTBase model to quantify.
+    target_nodes (list) : the node_ids of the target nodes.
+    ag_method (AggregationMethod) : the enum value representing the type of AggregationMethod to use.
+    workers (int) : the number of worker processes, defaults to the number of CPUs.
+    '''
+    target_nodes = list(target_nodes)
+    workers = workers or os.cpu_count() or 1
+    file_path = str(model.db.file_path)
+    seeds = Estimate.spawn_seeds(len(target_nodes))
+    if file_path == ':memory:' or workers == 1 or len(target_nodes) < 2:
+        return { target_node : _calculate_seeded(model, target_node, ag_method, seed)
+            for target_node, seed in zip(target_nodes, seeds) }
+    workers = min(workers, len(target_nodes))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(file_path,)) as executor:
+        cpts = executor.map(_calculate_worker, target_nodes, repeat(ag_method), seeds,
+            chunksize=math.ceil(len(target_nodes) / workers))
+        return dict(zip(target_nodes, cpts))
+
+# the Model opened by a calculate_many worker process
+_worker_model = None
+
+def _init_worker(file_path: str) -> None:
+    '''
+    Opens the model database in a calculate_many worker process.
+
+    Parameters
+    ----------
+    file_path (str) : the file path of the model database.
+    '''
+    global _worker_model
+    DB.reset_pool()
+    _worker_model = Model(file_path)
+
+def _calculate_worker(target_node: str, ag_method: AggregationMethod, seed: np.random.SeedSequence) -> dict:
+    '''
+    Returns the conditional probability table of a target node in a calculate_many worker process.
+
+    Parameters
+    ----------
+    target_node(str) : the node_id of the target node.
+    ag_method (AggregationMethod) : the enum value representing the type of AggregationMethod to use.
+    seed (np.random.SeedSequence) : the seed for the target node's samples.
+    '''
+    return _calculate_seeded(_worker_model, target_node, ag_method, seed)
+
+def _calculate_seeded(model: Model, target_node: str, ag_method: AggregationMethod,
+        seed: np.random.SeedSequence) -> dict:
+    '''
+    Returns the conditional probability table of a target node, reseeding the Estimates first.
+
+    Parameters
+    ----------
+    model (DTBase) : the DTBase model to quantify.
+    target_node(str) : the node_id of the target node.
+    ag_method (AggregationMethod) : the enum value representing the type of AggregationMethod to use.
+    seed (np.random.SeedSequence) : the seed for the target node's samples.
+    '''
+    Estimate.seed(seed)
+    return calculate(model, target_node, ag_method)
+
+def export_cpt(cpt: dict, file_path: str) -> None:
+    '''
+    Writes a conditional probability table calculated using calculate to a .csv file with a
+    subset, mean, std header and one row per subset of parents.
+
+    Parameters
+    ----------
+    cpt (dict) : the conditional probability table to export.
+    file_path (str) : the file path of the .csv file to write.
+    '''
+    with open(file_path, 'w', newline='', buffering=1 << 20) as f:
+        writer = csv.writer(f)
+        writer.writerow(('subset', 'mean', 'std'))
+        writer.writerows((','.join(parents), mean, std) for parents, (mean, std) in cpt.items())
+
+@lru_cache(maxsize=32)
+def parent_subsets(n: int) -> tuple:
+    '''
+    Returns every non-empty subset of n parents as a tuple of parent indices, ordered by
+    subset size. Every target node with n parents reuses the same cached tuple.
+
+    Parameters
+    ----------
+    n (int) : the number of parents.
+    '''
+    return tuple(combo for i in range(1, n + 1) for combo in combinations(range(n), i))
+
+@lru_cache(maxsize=32)
+def gray_code_steps(n: int) -> tuple:
     '''
-    Returns a defaultdict with the normalized weights for each link pointing to the target node.
-    The result is a map of link_id -> weight.
+    Returns the non-empty subsets of n parents in Gray code order as (bitmask, row, add) triples,
+    where the subset differs from the previous one by parent row, which is added if add is True
+    and removed otherwise.
+
+    Parameters
+    ----------
+    n (int) : the number of parents.
+    '''
+    steps = []
+    mask = 0
+    for code in range(1, 1 << n):
+        gray = code ^ (code >> 1)
+        changed = gray ^ mask
+        steps.append((gray, changed.bit_length() - 1, bool(gray & changed)))
+        mask = gray
+    return tuple(steps)
+
+def calc_normalized_weights(model: Model, target_node: str) -> dict:
+    '''
+    Returns a dict with the normalized weights for each link pointing to the target node.
+    The result is a map of link_id -> weight, where the weight of a link that is the only
+    link from its parent is the scalar 1.0.
 
     Parameters
     ----------
     model (DTBase) : the DTBase model to quantify.
     target_node(str) : the node_id of the target node.
     '''
-    links = set()
-    Z = { node_id : np.zeros(sample_size) for node_id in model.graph.predecessors(target_node) }
-    for parent_id in Z:    
-        for edge in model.graph.get_edge_data(parent_id, target_node).values():
-            link = model.get_link(edge['link_id'])
-            Z[parent_id] += link.m1.sample * link.m3.sample
-            links.add(link)
-    weights = defaultdict(lambda: np.zeros(sample_size))
-    for parent_id in Z:    
-        for edge in model.graph.get_edge_data(parent_id, target_node).values():
-            link = model.get_link(edge['link_id'])
-            weights[link.link_id] = (link.m1.sample * link.m3.sample) / Z[link.parent_id]
+    links = incoming_links(model, target_node)
+    if not links:
+        return {}
+    _, parent_idx = parent_index(links)
+    # a link normalized only against itself has a weight of 1, so it needs no m1 or m3 samples
+    counts = np.bincount(parent_idx)
+    shared = counts[parent_idx] > 1
+    weights = { link.link_id : 1.0 for link, is_shared in zip(links, shared) if not is_shared }
+    if not shared.any():
+        return weights
+    links = [link for link, is_shared in zip(links, shared) if is_shared]
+    _, parent_idx = parent_index(links)
+    Estimate.sample_all([m for link in links for m in (link.m1, link.m3)])
+    # (links x samples) array of m1 * m3, summed per parent to normalize
+    num = np.stack([link.m1.sample for link in links]).astype(float)
+    num *= np.stack([link.m3.sample for link in links])
+    Z = sum_by_parent(num, parent_idx)
+    normalized = num / Z[parent_idx]
+    weights.update((link.link_id, normalized[i]) for i, link in enumerate(links))
     return weights
 
-def calc_cp_arithmetic(model: Model, target_node: str, normalized_weights: defaultdict) -> defaultdict:
+def incoming_links(model: Model, target_node: str) -> list:
+    '''
+    Returns a list of all the Links pointing to the target node.
+
+    Parameters
+    ----------
+    model (DTBase) : the DTBase model to quantify.
+    target_node(str) : the node_id of the target node.
+    '''
+    return list(model.db.iter_links(child_id=target_node))
+
+def parent_index(links: list) -> tuple:
+    '''
+    Returns a (parents, parent_idx) tuple for a list of Links, where parents is a map of
+    parent node_id -> row and parent_idx is an array with the parent row of each Link.
+
+    Parameters
+    ----------
+    links (list) : the Links pointing to a target node.
+    '''
+    parents = {}
+    parent_idx = np.array([parents.setdefault(link.parent_id, len(parents)) for link in links], dtype=np.int32)
+    return parents, parent_idx
+
+def sum_by_parent(values: np.array, parent_idx: np.array) -> np.array:
     '''
-    Returns a defaultdict with the aggregated weight using arithmetic mean of a link between two nodes.
+    Returns a (parents x samples) array with the rows of values summed per parent. The rows are
+    grouped by parent with a stable sort and each group is reduced with a single np.add.reduceat.
+
+    Parameters
+    ----------
+    values (np.array) : a (links x samples) array with one row per Link.
+    parent_idx (np.array) : the parent row of each Link, as returned by parent_index.
+    '''
+    order = np.argsort(parent_idx, kind='stable')
+    starts = np.flatnonzero(np.diff(parent_idx[order], prepend=-1))
+    return np.add.reduceat(values[order], starts, axis=0)
+
+def calc_cp_arithmetic(model: Model, target_node: str, normalized_weights: dict) -> dict:
+    '''
+    Returns a dict with the aggregated weight using arithmetic mean of a link between two nodes.
     The result is a map of parent node_id -> weight.
 
     Parameters
     ----------
     model (DTBase) : the DTBase model to quantify.
     target_node(str) : the node_id of the target node.
-    normalized_weights (defaultdict) : the normalized weights calculated using calc_normalized_weights.
+    normalized_weights (dict) : the normalized weights calculated using calc_normalized_weights.
     '''
-    cp = defaultdict(lambda: np.zeros(sample_size))
-    for parent_id in model.graph.predecessors(target_node):         
-        for edge in model.graph.get_edge_data(parent_id, target_node).values():
-            link = model.get_link(edge['link_id'])
-            cp[parent_id] += normalized_weights[link.link_id] * link.m2.sample
-    return cp
+    links = incoming_links(model, target_node)
+    if not links:
+        return {}
+    parents, parent_idx = parent_index(links)
+    Estimate.sample_all([link.m2 for link in links])
+    # the weighted sum of m2 per parent
+    weighted_m2 = np.empty((len(links), sample_size))
+    for i, link in enumerate(links):
+        np.multiply(link.m2.sample, normalized_weights[link.link_id], out=weighted_m2[i])
+    cp = sum_by_parent(weighted_m2, parent_idx)
+    return { parent_id : cp[i] for parent_id, i in parents.items() }
 
-def calc_cp_geometric(model: Model, target_node: str, normalized_weights: defaultdict) -> defaultdict:
+def calc_cp_geometric(model: Model, target_node: str, normalized_weights: dict) -> dict:
     '''
-    Returns a defaultdict with the aggregated weight using geometric mean of a link between two nodes.
+    Returns a dict with the aggregated weight using geometric mean of a link between two nodes.
     The result is a map of parent node_id -> weight.
 
     Parameters
     ----------
     model (DTBase) : the DTBase model to quantify.
     target_node(str) : the node_id of the target node.
-    normalized_weights (defaultdict) : the normalized weights calculated using calc_normalized_weights.
+    normalized_weights (dict) : the normalized weights calculated using calc_normalized_weights.
     '''
-    cp = defaultdict(lambda: np.zeros(sample_size))
-    for parent_id in model.graph.predecessors(target_node):         
-        for edge in model.graph.get_edge_data(parent_id, target_node).values():
-            link = model.get_link(edge['link_id'])
-            cp[parent_id] *= link.m2.sample ** normalized_weights[link.link_id]
+    links = incoming_links(model, target_node)
+    if not links:
+        return {}
+    Estimate.sample_all([link.m2 for link in links])
+    # a draw of m2 <= 0 is taken as 0, which makes the product 0 unless its weight is 0,
+    # where the factor is 1; a parent with a single link of weight 1 has a product of m2
+    _, parent_idx = parent_index(links)
+    single = np.bincount(parent_idx)[parent_idx] == 1
+    cp = {}
+    for link, is_single in zip(links, single):
+        w = normalized_weights[link.link_id]
+        if is_single and np.isscalar(w) and w == 1:
+            cp[link.parent_id] = np.maximum(link.m2.sample, 0.0, dtype=float)
+    links = [link for link in links if link.parent_id not in cp]
+    if not links:
+        return cp
+    parents, parent_idx = parent_index(links)
+    # the weighted product of m2 per parent, accumulated as a sum of logs
+    log_m2 = np.empty((len(links), sample_size))
+    for i, link in enumerate(links):
+        row = log_m2[i]
+        w = normalized_weights[link.link_id]
+        np.maximum(link.m2.sample, 0.0, out=row)
+        with np.errstate(divide='ignore'):
+            np.log(row, out=row)
+        np.multiply(row, w, out=row, where=w != 0)
+        row[w == 0] = 0.0
+    log_cp = sum_by_parent(log_m2, parent_idx)
+    np.exp(log_cp, out=log_cp)
+    cp.update((parent_id, log_cp[i]) for parent_id, i in parents.items())
     return cp
 
-def calc_noisy_or(aggregated_cp: defaultdict, parent_ids: tuple) -> np.array:
+def calc_noisy_or(aggregated_cp: dict, parent_ids: tuple) -> np.array:
     '''
     Returns the noisy or approximating for P(target_node | parents).
 
@@ -110,6 +318,73 @@ def calc_noisy_or(aggregated_cp: defaultdict, parent_ids: tuple) -> np.array:
     parent_ids (tuple) : a tuple of all the parents in a given combination.
     '''
     prod = np.ones(sample_size)
+    scratch = np.empty(sample_size)
     for parent_id in parent_ids:
-        prod *= np.ones(sample_size) - aggregated_cp[parent_id]
-    return 1 - prod
\ No newline at end of file
+        np.subtract(1.0, aggregated_cp[parent_id], out=scratch)
+        prod *= scratch
+    np.subtract(1.0, prod, out=prod)
+    return prod
+
+def calc_noisy_or_subsets(aggregated_cp: dict, parent_ids: list) -> np.ndarray:
+    '''
+    Returns the mean and standard deviation of the noisy or approximation for P(target_node | parents)
+    for every subset of parent_ids. The result is a structured array of CPT_DTYPE indexed by subset
+    bitmask, where bit j of the bitmask is set if parent_ids[j] is in the subset; the empty subset
+    at index 0 is (0, 0).
+
+    Parameters
+    ----------
+    aggregated_cp (DTBase) : the aggregated conditional probability map calculated using one of the aggregation methods.
+    parent_ids (list) : a list of all the parents of the target node.
+    '''
+    n = len(parent_ids)
+    out = np.zeros(1 << n, dtype=CPT_DTYPE)
+    if not n:
+        return out
+    cp = np.stack([aggregated_cp[parent_id] for parent_id in parent_ids])
+    # log(1 - P(target_node | parent)) for each parent, computed once for all subsets, so the
+    # product over a subset becomes a sum; a probability of 1 is floored to LOG_FLOOR rather
+    # than -inf so it can be subtracted again, and exp(LOG_FLOOR) still underflows to 0.
+    # A parent with any P outside [0, 1] has no real log and keeps the product form instead.
+    in_range = ((cp >= 0) & (cp <= 1)).all(axis=1)
+    log_one_minus = np.zeros_like(cp)
+    with np.errstate(divide='ignore'):
+        log_one_minus[in_range] = np.log1p(-cp[in_range])
+    np.maximum(log_one_minus, LOG_FLOOR, out=log_one_minus)
+    out_of_range = [(1 << j, 1 - cp[j]) for j in np.flatnonzero(~in_range)]
+    # visit the subsets in Gray code order, where each subset adds or removes a single
+    # parent from the previous one, so the running log sum is updated with one row
+    running = np.zeros(cp.shape[1])
+    buf = np.empty_like(running)
+    for mask, row, add in gray_code_steps(n):
+        if in_range[row]:
+            if add:
+                running += log_one_minus[row]
+            else:
+                running -= log_one_minus[row]
+        np.exp(running, out=buf)
+        for bit, one_minus in out_of_range:
+            if mask & bit:
+                buf *= one_minus
+        np.subtract(1.0, buf, out=buf)
+        out[mask] = mean_std(buf)
+    return out
+
+def mean_std(buf: np.array) -> tuple:
+    '''
+    Returns the (mean, std) of a sample without allocating temporaries. The deviations
+    from the mean are computed in place, so the contents of buf are overwritten.
+
+    Parameters
+    ----------
+    buf (np.array) : the sample, used as scratch space.
+    '''
+    mean = buf.mean()
+    buf -= mean
+    return mean, np.sqrt(np.dot(buf, buf) / buf.size)
+
+# aggregation function of each AggregationMethod, used by calculate
+_AGGREGATORS = {
+    AggregationMethod.ARITHMETIC : calc_cp_arithmetic,
+    AggregationMethod.GEOMETRIC : calc_cp_geometric,
+}
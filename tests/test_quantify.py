@@ -0,0 +1,54 @@
+import unittest
+from itertools import combinations
+import numpy as np
+from dtbase.quantify import calc_noisy_or, calc_noisy_or_subsets, sample_size
+
+class TestNoisyOrSubsets(unittest.TestCase):
+    '''
+    Checks calc_noisy_or_subsets against the direct product in calc_noisy_or.
+    '''
+    def assert_matches_noisy_or(self, aggregated_cp: dict) -> None:
+        '''
+        Asserts that every subset of the parents in aggregated_cp matches calc_noisy_or.
+
+        Parameters
+        ----------
+        aggregated_cp (dict) : a map of parent node_id -> P(target_node | parent) sample.
+        '''
+        parent_ids = list(aggregated_cp)
+        subsets = calc_noisy_or_subsets(aggregated_cp, parent_ids)
+        for i in range(1, len(parent_ids) + 1):
+            for combo in combinations(range(len(parent_ids)), i):
+                c = calc_noisy_or(aggregated_cp, tuple(parent_ids[j] for j in combo))
+                mask = sum(1 << j for j in combo)
+                np.testing.assert_allclose(
+                    (subsets['mean'][mask], subsets['std'][mask]), (c.mean(), c.std()),
+                    rtol=1e-12, atol=1e-12, equal_nan=True, err_msg=str(combo))
+
+    def test_in_range(self):
+        rng = np.random.default_rng(0)
+        aggregated_cp = { parent_id : rng.random(sample_size) for parent_id in 'abcdef' }
+        aggregated_cp['c'][:5] = 1.0
+        self.assert_matches_noisy_or(aggregated_cp)
+
+    def test_out_of_range(self):
+        # NORMAL Estimates give probabilities above 1 and below 0
+        rng = np.random.default_rng(1)
+        aggregated_cp = { parent_id : rng.random(sample_size) for parent_id in 'abcd' }
+        aggregated_cp['b'] = rng.normal(.945, .03, sample_size)
+        aggregated_cp['d'] = rng.normal(.05, .05, sample_size)
+        self.assert_matches_noisy_or(aggregated_cp)
+        self.assertFalse(np.isnan(calc_noisy_or_subsets(aggregated_cp, list(aggregated_cp))['mean']).any())
+
+    def test_non_finite(self):
+        # a non-finite parent only affects the subsets that contain it
+        rng = np.random.default_rng(2)
+        aggregated_cp = { parent_id : rng.random(sample_size) for parent_id in 'abcd' }
+        aggregated_cp['b'][0] = np.nan
+        self.assert_matches_noisy_or(aggregated_cp)
+        subsets = calc_noisy_or_subsets(aggregated_cp, list(aggregated_cp))
+        for mask in range(1, 16):
+            self.assertEqual(np.isnan(subsets['mean'][mask]), bool(mask & 0b10))
+
+if __name__ == '__main__':
+    unittest.main()